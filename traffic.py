@@ -1,7 +1,8 @@
-from enum import Flag
-from typing import List, Tuple
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import List, Optional, Tuple
 import numpy as np
-import pandas as pd
+from numba import njit
 import matplotlib.pyplot as plt
 import json
 from os import path
@@ -12,6 +13,7 @@ from os import path
 # Make sure to include config.json file within the script folder
 # Make sure that the config files includes all constans and 
 # lane objects you would like to include into your code
+# Requires numpy, numba and matplotlib to be installed
 ####################################
 
 CONFIG_PATH = "config.json"
@@ -21,99 +23,166 @@ CONFIG_PATH = "config.json"
 GREEN_CARS = 30 # Duration of green light for cars
 GREEN_BIKES = 10 # Duration of green light for bikes
 RED_TIME_ALL = 10 # Duration of red light for all vehicles
-CYCLE_LENGTH = GREEN_CARS + GREEN_BIKES + 2 * RED_TIME_ALL # Total cycle length
 
 # Value is defined in hours (eg. 1 means it is goig to run for 3600 seconds (1h))
 SIM_LENGTH = 0.1
 
-class LaneType:
+# Lanes with lower busyness get at most one vehicle per second (Bernoulli instead of Poisson arrivals).
+# This keeps the mean number of arrivals, but not their variance: near the threshold (eg. 0.29) about 3.5% of
+# seconds would have two or more arrivals, about 25% of the vehicles arrive in such seconds, and the variance
+# per second is about 29% lower, so queue lengths of these lanes vary less than with Poisson arrivals
+LOW_BUSYNESS = 0.3
+
+# Random generator shared by all simulations that are not given their own seed
+_RNG = np.random.default_rng()
+
+class LaneType(IntEnum):
     """Number of Car and Bikes which pass trough the intersection per time unit
     """
     CAR = 1
     BIKE = 2
 
 
+# Lane types as written in the config file, anything else is treated as a bike lane
+_TYPE_MAP = {"car": LaneType.CAR, "bike": LaneType.BIKE}
+
+
 class Lane:
-    """Contains a defintion with attributes describing the each lane object and a method for updating the number of the vehicles in the queue
+    """Contains a defintion with attributes describing the each lane object. The simulation state of all lanes
+    is kept in arrays on the Main object
     """
     def __init__(self, lane_type : int, busyness: float):
-        self.green_light = False # True if GREEN, False if RED
-        self.vehicle_num = 0
+        # Busyness is the mean number of vehicles arriving per second, so it can't be negative
+        try:
+            valid = not isinstance(busyness, bool) and busyness >= 0
+        except TypeError:
+            valid = False
+        if not valid:
+            raise ValueError(f"Lane busyness has to be a non-negative number, got {busyness!r}")
+
         self.lane_type = lane_type
         self.busyness = busyness
 
 
-    def update_vehicle_number(self) -> None:
-        """Adds random number (based on the busyness value of the lane) of vehicles to the queue and removes them if conditions are met
+@dataclass(frozen=True)
+class Config:
+    """Traffic light and simulation settings, defaults to the backup global constants
+    """
+    green_cars: int = GREEN_CARS
+    green_bikes: int = GREEN_BIKES
+    red_time_all: int = RED_TIME_ALL
+    sim_length: float = SIM_LENGTH
+
+    def __post_init__(self):
+        """Light durations are used as array sizes and indices, so they have to be non-negative whole seconds
+        (eg. 10 or 10.0) and the cycle can't be empty. Simulation length can't be negative. Raises ValueError otherwise
         """
-        # Add random nuber of vehicles to lane based on busyness
-        self.vehicle_num += np.random.poisson(self.busyness)
-
-        # Removes vehicles from lane per conditions
-        if self.green_light and (self.vehicle_num > 0):
-            #To prevent negative bike numbers snice they usually move two at a time
-            if self.lane_type == LaneType.BIKE and (self.vehicle_num == 1):
-                self.vehicle_num -= 1
-            else:
-                self.vehicle_num -= self.lane_type
+        for name in ("green_cars", "green_bikes", "red_time_all"):
+            value = getattr(self, name)
+            try:
+                # JSON true/false would otherwise pass as 1 and 0
+                valid = not isinstance(value, bool) and float(value).is_integer() and value >= 0
+            except (TypeError, ValueError):
+                valid = False
+            if not valid:
+                raise ValueError(f"{name} has to be a non-negative whole number of seconds, got {value!r}")
+            # Dataclass is frozen, so the converted value has to be set trough object
+            object.__setattr__(self, name, int(value))
+
+        # Simulation length is used for the number of rows of the traffic data
+        try:
+            valid = not isinstance(self.sim_length, bool) and self.sim_length >= 0
+        except TypeError:
+            valid = False
+        if not valid:
+            raise ValueError(f"sim_length has to be a non-negative number of hours, got {self.sim_length!r}")
+
+        if self.cycle_length <= 0:
+            raise ValueError("Traffic light cycle has to be at least one second long")
+
+    @property
+    def cycle_length(self) -> int:
+        """Total cycle length
+        """
+        return self.green_cars + self.green_bikes + 2 * self.red_time_all
 
 
 class JsonReader:
-    """Helper class to read the config.json file that sets the default values if the file is missing or incorrect. It can also return
-    a None value in case the configuration file could not be read correctly
+    """Helper class to read the config.json file that sets the default values if the file is missing or incorrect. In case the
+    configuration file could not be read correctly it returns the default configuration and an empty list of lanes
     """
-    staticmethod
-    def parse(filename : str) -> List[Lane]:
-        """Takes a string with the filename as paramater and returns a list of lane object initialized to the values from the file
+    @staticmethod
+    def parse(filename : str) -> Tuple[Config, List[Lane]]:
+        """Takes a string with the filename as paramater and returns the configuration and a list of lane object initialized
+        to the values from the file
         """
         lanes = []
 
-        # Varables that need to be changed outside the method
-        global GREEN_CARS
-        global GREEN_BIKES
-        global RED_TIME_ALL
-        global SIM_LENGTH
-        global CYCLE_LENGTH
-        
         print("Reading configuration file")
 
         # If the config file exsits with the proper name
-        if path.exists(CONFIG_PATH):
+        if path.exists(filename):
             # Open file in read mode
             with open(filename, "r") as f:
                 try:
                     j = json.load(f)
                 except json.decoder.JSONDecodeError:
                     print(colored(255, 255, 0,"WARNING: Configuration file is not properly formated"))
-                    return lanes
+                    return Config(), lanes
                 
                 # Checks if values are set in JSON file otherwise it sets defaults
-                GREEN_CARS = j["GREEN_CARS"] if "GREEN_CARS" in j else GREEN_CARS
-                GREEN_BIKES = j["GREEN_BIKES"] if "GREEN_BIKES" in j else GREEN_BIKES
-                RED_TIME_ALL = j["RED_TIME_ALL"] if "RED_TIME_ALL" in j else RED_TIME_ALL
-                SIM_LENGTH = j["SIM_LENGTH"] if "SIM_LENGTH" in j else SIM_LENGTH
-                CYCLE_LENGTH = GREEN_CARS + GREEN_BIKES + 2 * RED_TIME_ALL
+                try:
+                    config = Config(green_cars=j.get("GREEN_CARS", GREEN_CARS),
+                                    green_bikes=j.get("GREEN_BIKES", GREEN_BIKES),
+                                    red_time_all=j.get("RED_TIME_ALL", RED_TIME_ALL),
+                                    sim_length=j.get("SIM_LENGTH", SIM_LENGTH))
+                except ValueError:
+                    print(colored(255, 255, 0,"WARNING: Configuration file is not properly formated"))
+                    return Config(), lanes
 
                 # If lanes in json exist it returns them, otherwise returns empty list
                 if not "lanes" in j:
-                    return lanes
+                    return config, lanes
                 
                 # Creates lane objects from the file and places them in a list
-                for lane in j["lanes"]:
-                    lane_type = LaneType.CAR if lane["type"] == "car" else LaneType.BIKE
-                    lanes.append(Lane(lane_type, lane["busyness"]))
+                try:
+                    for lane in j["lanes"]:
+                        lanes.append(Lane(_TYPE_MAP.get(lane["type"], LaneType.BIKE), lane["busyness"]))
+                except ValueError:
+                    print(colored(255, 255, 0,"WARNING: Configuration file is not properly formated"))
+                    return config, []
 
-                return lanes     
+                return config, lanes     
         # If the file doesn't exist
         else:
-            print(colored(255, 255, 0,f"WARNING: File '{CONFIG_PATH}' was not found in the script folder"))
-            return lanes
+            print(colored(255, 255, 0,f"WARNING: File '{filename}' was not found in the script folder"))
+            return Config(), lanes
+
+
+@njit(cache=True)
+def simulate(arrivals, ltype, green_schedule, tick_idx, out, cols):
+    """Runs the whole simulation in one compiled pass and writes the number of vehicles in every lane for every second
+    into out, lane k is written into column cols[k]
+    """
+    vnum = np.zeros(arrivals.shape[1], np.int32)
+
+    for t in range(arrivals.shape[0]):
+        for k in range(arrivals.shape[1]):
+            # Add vehicles to the queue and on green light remove one car or two bikes from it,
+            # capped by the queue length to prevent negative numbers when only one bike is waiting
+            queue = vnum[k] + arrivals[t, k]
+            vnum[k] = queue - green_schedule[tick_idx[t], k] * min(ltype[k], queue)
+
+            out[t, cols[k]] = vnum[k]
 
 
 class Main:
     """Main function called at program startup that contains main execution order
     """
-    def __init__(self):
+    def __init__(self, seed : Optional[int] = None):
+        # Random generator used for vehicle arrivals, seed can be set for reproducible runs
+        self.rng = _RNG if seed is None else np.random.default_rng(seed)
+
         # lane_count is only used if the JSON is not correctly read or is missing
         self.lane_count = 4
 
@@ -121,25 +190,11 @@ class Main:
         self.lanes = []
 
         # Creates lane objects based on the numbers of lanes in the config file
-        self.lanes = JsonReader.parse(CONFIG_PATH)
+        self.config, self.lanes = JsonReader.parse(CONFIG_PATH)
+        config = self.config
 
-        # If lanes list is empty
-        if self.lanes:
-            # Sorts bikes and car lanes intro seperate list for graph drawing
-            bikes = list(filter(lambda a: a.lane_type == LaneType.BIKE, self.lanes))
-            cars = list(filter(lambda a: a.lane_type == LaneType.CAR, self.lanes))
-            # Dinamically adds names for line chart for bikes
-            self.columns.append("bikelight")
-            for i in range(len(bikes)):
-                self.columns.append("Bikes " + str(i+1))
-        
-            # Dinamically adds names for line chart for bikes
-            self.columns.append("carlight")
-            for i in range(len(cars)):
-                self.columns.append("Cars " + str(i+1))
-    
         # Fallbak scenario in case there are not any lanes in the config file
-        else:
+        if not self.lanes:
             print(colored(255, 255, 0, "WARNING: Using default configuration for simulation"))
             self.columns = ['Bike lanes', 'Bikes 1', 'Bikes 2', 
                     'Car lanes', 'Cars 1', 'Cars 2']
@@ -148,82 +203,99 @@ class Main:
                 lane_type = LaneType.BIKE if i >= self.lane_count / 2 else LaneType.CAR
                 self.lanes.append(Lane(lane_type, (self.lane_count - i) * 0.1))
 
-        self.bikes = list(filter(lambda a: a.lane_type == LaneType.BIKE, self.lanes))
-        self.cars = list(filter(lambda a: a.lane_type == LaneType.CAR, self.lanes))
+        # Lane state is stored as one array per attribute, indexed by lane
+        n = len(self.lanes)
+        self.busyness = np.array([lane.busyness for lane in self.lanes])
+        self.ltype = np.fromiter((lane.lane_type for lane in self.lanes), np.int8, count=n)
+
+        # Indices of bike and car lanes for graph drawing
+        self.bike_idx = np.flatnonzero(self.ltype == LaneType.BIKE)
+        self.car_idx = np.flatnonzero(self.ltype == LaneType.CAR)
+
+        # Lanes read from the config file
+        if not self.columns:
+            # Dinamically adds names for line chart for bikes
+            self.columns.append("bikelight")
+            for i in range(len(self.bike_idx)):
+                self.columns.append("Bikes " + str(i+1))
+        
+            # Dinamically adds names for line chart for cars
+            self.columns.append("carlight")
+            for i in range(len(self.car_idx)):
+                self.columns.append("Cars " + str(i+1))
 
-        # Crate pandas dataframe
-        self.traffic_data = pd.DataFrame(columns=self.columns)
         print("Running simulation...")
-        # The loop is iterated every second for SIM_LENGTH hours
-        loop_count = int(3600 * SIM_LENGTH)
-        for i in range(loop_count):
-            self.loop(i)
+        # The loop is iterated every second for sim_length hours
+        loop_count = int(3600 * config.sim_length)
+
+        # Random number of vehicles arriving to every lane in every second, based on busyness
+        # Generator.poisson always returns int64, so lanes are drawn one at a time to keep the temporary
+        # array to a single column before it is stored as int16
+        int16_max = np.iinfo(np.int16).max
+        self.arrivals = np.empty((loop_count, n), np.int16)
+        # Total number of vehicles arriving to every lane, counted before the draws are narrowed
+        totals = np.zeros(n, np.int64)
+        for k in range(n):
+            if self.busyness[k] < LOW_BUSYNESS:
+                draw = self.rng.random(loop_count, dtype=np.float32) < self.busyness[k]
+            else:
+                draw = self.rng.poisson(self.busyness[k], loop_count)
+                # Widen the arrivals in case a single second doesn't fit into int16
+                if draw.max(initial=0) > int16_max and self.arrivals.dtype == np.int16:
+                    self.arrivals = self.arrivals.astype(np.int32)
+            self.arrivals[:, k] = draw
+            totals[k] = draw.sum()
+
+        # Traffic light state for bikes and cars on every tick of the cycle, True if GREEN, False if RED
+        car_start = config.green_bikes + config.red_time_all
+        self.bike_green = np.zeros(config.cycle_length, bool)
+        self.car_green = np.zeros(config.cycle_length, bool)
+        self.bike_green[0:config.green_bikes] = True
+        self.car_green[car_start : car_start + config.green_cars] = True
+
+        # Tick of the cycle for every second of the simulation, has a domain of 0 to cycle_length - 1
+        self.tick_idx = np.arange(loop_count, dtype=np.int32) % config.cycle_length
+
+        # Which lanes have green light on every tick of the cycle
+        self.green_schedule = np.where(self.ltype == LaneType.CAR, self.car_green[:, None], self.bike_green[:, None])
+
+        # Preallocated buffer for traffic data, one row per second of the simulation
+        # A queue can never be longer than the number of vehicles that arrived to the lane,
+        # so int16 is used unless a lane could overflow it
+        dtype = np.int16 if totals.max(initial=0) <= int16_max else np.int32
+        self._buf = np.empty((loop_count, len(self.columns)), dtype=dtype)
+
+        # Light state columns, bike lanes follow the bike light and car lanes follow the car light
+        nb = len(self.bike_idx)
+        self._buf[:, 0] = self.bike_green[self.tick_idx]
+        self._buf[:, 1+nb] = self.car_green[self.tick_idx]
+
+        # Column of the traffic data every lane is written into
+        cols = np.empty(n, np.intp)
+        cols[self.bike_idx] = np.arange(1, 1+nb)
+        cols[self.car_idx] = np.arange(2+nb, 2+nb+len(self.car_idx))
+
+        # Number of vehicles in every lane for every second of the simulation
+        simulate(self.arrivals, self.ltype, self.green_schedule, self.tick_idx, self._buf, cols)
         
         # Displays the graph once the program is finished running
         self.draw_graph()
     
 
-    def set_lanes(self, lane_type : int, status : bool) -> None:
-        """Sets the status of the lane traffic light based on input parameters
-        """
-        for lane in self.lanes:
-            if lane.lane_type == lane_type:
-                lane.green_light = status
-    
-
-    # Loop is ran on every unit of time
-    def loop(self, iter_count : int) -> None:
-        """Runs every unit of time and checks for lane state changes
-        """
-        # Ticks has a domain of 0 to CYCLE_LENGTH - 1
-        ticks = iter_count % CYCLE_LENGTH
-
-        # Cycles through traffic light on specific ticks
-        if ticks == 0:
-            self.set_lanes(LaneType.CAR, False)
-            self.set_lanes(LaneType.BIKE, True)
-        elif ticks == GREEN_BIKES:
-            self.set_lanes(LaneType.BIKE, False)
-        elif ticks == GREEN_BIKES + RED_TIME_ALL:
-            self.set_lanes(LaneType.CAR, True)
-        elif ticks == GREEN_BIKES + RED_TIME_ALL + GREEN_CARS:
-            self.set_lanes(LaneType.CAR, False)
-        
-        # Update the vehicle queues
-        for lane in self.lanes:
-            lane.update_vehicle_number()
-
-        # Update traffic data
-        self.add_row(iter_count)
-
-
     def draw_graph(self) -> None:
         """Draws the grpah dinamicaly based on simulation parameters
         """
         print("Displaying the graph")
-        ax_traffic = self.traffic_data.plot(figsize=(20,10))
-        ax_traffic.set_ylim(0,25)
-        ax_traffic.set_xlim(0,SIM_LENGTH*3600) #Resizes the x axis according to simulation lenght
+        _, ax_traffic = plt.subplots(figsize=(20,10))
+        ax_traffic.plot(self._buf)
+        ax_traffic.legend(self.columns, loc='upper right')
+        ax_traffic.set(ylim=(0,25),
+                       xlim=(0,self.config.sim_length*3600), #Resizes the x axis according to simulation lenght
+                       ylabel='Number of vehicles waiting',
+                       xlabel='Amount of time passed since beginning')
+        # Title is set separately since Axes.set can't pass the font size
         ax_traffic.set_title('Lenght of the queue', size=16)
-        ax_traffic.set_ylabel('Number of vehicles waiting')
-        ax_traffic.set_xlabel('Amount of time passed since beginning')
         plt.show()
-    
-
-    def add_row(self, index : int) -> None:
-        """Helper function for grpah drawing to draw number of vehicles in one ponit in time
-        """
-        final = []
-        
-        final.append(self.bikes[0].green_light) if len(self.bikes) > 0 else 0
-        for bike in self.bikes:
-            final.append(bike.vehicle_num)
-        
-        final.append(self.cars[0].green_light) if len(self.cars) > 0 else 0
-        for car in self.cars:
-            final.append(car.vehicle_num)
-        
-        self.traffic_data.loc[index] = final
 
 
 def colored(r, g, b, text):